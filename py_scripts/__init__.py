@@ -0,0 +1,5 @@
+"""AC Transit real time fleet vehicle location scripts.
+
+Modules here are side-effect free on import; heavy dependencies and
+credentials are only loaded once a command that needs them runs.
+"""
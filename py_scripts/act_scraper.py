@@ -1,25 +1,26 @@
-import glob
 import json
 import os
-import requests
 import time
 import random
 
-from google.protobuf import json_format
-from google.transit import gtfs_realtime_pb2
-
 # Globals
 AC_BASE_URL = 'http://api.actransit.org/transit'
+TOKEN_ENV_VAR = 'ACT_GTFSRT_TOKENS'
+
 
-# Acquire the tokens from the .env file in root
-token_env_var = 'ACT_GTFSRT_TOKENS'
-if token_env_var not in os.environ:
-    raise KeyError('No tokens set under {} in .env file'.format(token_env_var))
-tokens = os.environ[token_env_var].split(' ')  # Use space deliminated keys
-print('Using {} tokens'.format(len(tokens)))
+def get_tokens():
+    # Acquire the tokens from the .env file in root; only
+    # read when a scrape is actually about to run
+    if TOKEN_ENV_VAR not in os.environ:
+        raise KeyError('No tokens set under {} in .env file'.format(TOKEN_ENV_VAR))
+    return os.environ[TOKEN_ENV_VAR].split(' ')  # Use space deliminated keys
 
 
 def convert_pb_to_json(content):
+    # Protobuf bindings are only needed by the scraper itself
+    from google.protobuf import json_format
+    from google.transit import gtfs_realtime_pb2
+
     feed = gtfs_realtime_pb2.FeedMessage()
     feed.ParseFromString(content)
     return json.loads(json_format.MessageToJson(feed))
@@ -40,11 +41,18 @@ def get_daily_dir():
     return target_dir
 
 
+def get_snapshot_day(fpath):
+    # Snapshots are filed under busdata/<YYYYMMDD>/
+    return os.path.basename(os.path.dirname(fpath))
+
+
 def get_vehicles_url(token):
     return '{}/gtfsrt/vehicles?token={}'.format(AC_BASE_URL, token)
 
 
-while True:
+def scrape_once(tokens):
+    import requests
+
     # AC Transit is finicky about hitting rate limits even though we
     # aren't even getting remotely close according to their TOU
     token = random.choice(tokens)
@@ -57,16 +65,15 @@ while True:
     except Exception as e:
         print('Error occurred on this query: {}'.format(template))
         print('Error: {}'.format(e))
-        res_json = False
+        return None
 
-    if res_json is not False:
-        # Create output file location
-        seconds = int(round(time.time(), 0))
-        output_fname = '.'.join([str(seconds), 'json'])
-        output_fpath = '/'.join([get_daily_dir(), output_fname])
+    # Create output file location
+    seconds = int(round(time.time(), 0))
+    output_fname = '.'.join([str(seconds), 'json'])
+    output_fpath = '/'.join([get_daily_dir(), output_fname])
 
-        print('Got locations; saving to {}'.format(output_fpath))
-        with open(output_fpath, 'w') as outfile:
-            json.dump(res_json, outfile)
+    print('Got locations; saving to {}'.format(output_fpath))
+    with open(output_fpath, 'w') as outfile:
+        json.dump(res_json, outfile)
 
-    time.sleep(30)
+    return output_fpath
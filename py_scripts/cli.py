@@ -0,0 +1,79 @@
+import argparse
+
+TOLERANCE_HELP = 'trace simplification tolerance in degrees (0 disables; default about 5m)'
+
+
+def _run(args):
+    from . import pipeline
+    pipeline.run(interval=args.interval, upload_workers=args.upload_workers,
+                 queue_size=args.queue_size, output=args.output, tolerance=args.tolerance)
+
+
+def _scrape(args):
+    from . import act_scraper
+    act_scraper.scrape_once(act_scraper.get_tokens())
+
+
+def _upload(args):
+    from . import scrape_loader
+    scrape_loader.sync_storage_from_local()
+
+
+def _compile(args):
+    from . import daily_compiler
+    daily_compiler.compile_daily(day_dir=args.day_dir, output=args.output, tolerance=args.tolerance)
+
+
+def _render(args):
+    from . import gif_generator
+    gif_generator.render(args.day, tolerance=args.tolerance)
+
+
+def _publish(args):
+    from . import gif_generator
+    gif_generator.publish(args.gif, args.day)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='py_scripts',
+        description='AC Transit vehicle location scraping and reporting')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run = subparsers.add_parser('run', help='scrape, upload, compile and render as one pipeline')
+    run.add_argument('--interval', type=int, default=30, help='seconds between scrapes')
+    run.add_argument('--upload-workers', type=int, default=4, help='concurrent uploads')
+    run.add_argument('--queue-size', type=int, default=100, help='snapshots buffered between stages')
+    run.add_argument('--output', default='daily.json', help='compiled daily output path')
+    run.add_argument('--tolerance', type=float, default=None, help=TOLERANCE_HELP)
+    run.set_defaults(func=_run)
+
+    scrape = subparsers.add_parser('scrape', help='fetch one GTFS-RT vehicle snapshot into busdata/')
+    scrape.set_defaults(func=_scrape)
+
+    upload = subparsers.add_parser('upload', help='sync busdata/ snapshots to cloud storage')
+    upload.set_defaults(func=_upload)
+
+    compile_ = subparsers.add_parser('compile', help='build daily.json feature collections')
+    compile_.add_argument('--day-dir', default='busdata_raw/', help='directory of snapshot jsons')
+    compile_.add_argument('--output', default='daily.json', help='output path')
+    compile_.add_argument('--tolerance', type=float, default=None, help=TOLERANCE_HELP)
+    compile_.set_defaults(func=_compile)
+
+    render = subparsers.add_parser('render', help='render the peak hour animation to gif/')
+    render.add_argument('day', nargs='?', default=None, help='day to evaluate as YYYYMMDD (default: yesterday)')
+    render.add_argument('--tolerance', type=float, default=None, help=TOLERANCE_HELP)
+    render.set_defaults(func=_render)
+
+    publish = subparsers.add_parser('publish', help='upload and tweet a rendered animation')
+    publish.add_argument('--gif', default='gif/animate.gif', help='path of the gif to publish')
+    publish.add_argument('--day', default=None, help='day the gif shows as YYYYMMDD (default: today)')
+    publish.set_defaults(func=_publish)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
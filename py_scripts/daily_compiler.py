@@ -1,16 +1,14 @@
+import calendar
 import colorsys
 import datetime
 import json
 import os
 import random
-import sys
-import time
-
-import pandas as pd
 
 # TODO: Load source using GCloud utils, download
 #       to local tempfile
-day_dir = 'busdata_raw/'
+DEFAULT_DAY_DIR = 'busdata_raw/'
+DEFAULT_OUTPUT = 'daily.json'
 
 
 def get_random_bright_color():
@@ -19,7 +17,9 @@ def get_random_bright_color():
     return '#%02x%02x%02x' % (r, g, b)
 
 
-def add_colors_to_routes(vr: pd.DataFrame):
+def add_colors_to_routes(vr: 'pd.DataFrame'):
+    import pandas as pd
+
     route_color_lookup = []
     for vid in vr.route_id.unique():
         route_color_lookup.append({
@@ -82,55 +82,81 @@ def get_all_possible_jsons(target_dir):
     return to_use
 
             
+def load_snapshot_records(fpath):
+    # Try to load the vehicle locations as json
+    data = None
+    try:
+        with open(fpath, mode='r') as f:
+            data = json.load(f)
+    # Though some requests returned invalid data, in
+    # which case make a note of it and move on
+    except Exception as e:
+        print('Error opening {}'.format(fpath), e)
+        return []
+
+    # Make sure the data saved is what we expects
+    if not isinstance(data, dict):
+        print('Data invalid format: {}'.format(data))
+        return []
+    if 'entity' not in data.keys():
+        print('Data missing \'entity\' key: {}'.format(data))
+        return []
+
+    # We make certain assumptions about the data structure scraped
+    cleaned = []
+    for d in data['entity']:
+        try:
+            sd = summarize(d)
+            if sd is not None:
+                cleaned.append(sd)
+        except Exception as e:
+            print('Error parsing an entity: {}'.format(e))
+
+    if not len(cleaned):
+        print('{} had no valid location data'.format(fpath))
+    return cleaned
+
+
+def append_snapshot_records(fpath, records_path):
+    # Parse a snapshot as soon as it is written and add its records
+    # to the day's running file, one json object per line, so the
+    # day can be compiled without reading every snapshot again
+    records = load_snapshot_records(fpath)
+    with open(records_path, mode='a') as f:
+        for r in records:
+            r = dict(r, timestamp=calendar.timegm(r['timestamp'].utctimetuple()))
+            f.write(json.dumps(r) + '\n')
+    return len(records)
+
+
+def load_records_file(records_path):
+    records = []
+    with open(records_path, mode='r') as f:
+        for line in f:
+            # A partial last line is what an interrupted append leaves
+            try:
+                r = json.loads(line)
+            except ValueError:
+                print('Skipping unreadable line in {}'.format(records_path))
+                continue
+            r['timestamp'] = datetime.datetime.utcfromtimestamp(r['timestamp'])
+            records.append(r)
+    return records
+
+
 def generate_vehicle_results_df(to_use: list):
     # We will be assembling 2 daily wrap up CSVs
     vehicle_results = []
 
     # Iterate through the days' data
     for fpath in to_use:
-        # Try to load the vehicle locations as json
-        data = None
-        try:
-            with open(fpath, mode='r') as f:
-                data = json.load(f)
-        # Though some requests returned invalid data, in
-        # which case make a note of it and move on
-        except Exception as e:
-            print('Error opening {}'.format(fpath), e)
-            continue
-
-        # Make sure the data saved is what we expects
-        data_ok = False
-        if isinstance(data, dict):
-            if 'entity' in data.keys():
-                data_ok = True
-            else:
-                print('Data missing \'entity\' key: {}'.format(data))
-        else:
-            print('Data invalid format: {}'.format(data))
-
-        # Skip if the data is not usable
-        if not data_ok:
-            continue
-
-        # We make certain assumptions about the data structure scraped
-        cleaned = []
-        for d in data['entity']:
-            try:
-                sd = summarize(d)
-                if sd is not None:
-                    cleaned.append(sd)
-            except Exception as e:
-                print('Error parsing an entity: {}'.format(e))
+        vehicle_results.extend(load_snapshot_records(fpath))
+
+    return build_vehicle_results_df(vehicle_results)
 
-        if len(cleaned):
-            vehicle_results.extend(cleaned)
-        else:
-            print('{} had no valid location data'.format(path))
 
-        # Probably unnecessary, but since we are dealing with
-        # so much data, better to aggressively flush the data being read in
-        data = None
+def build_vehicle_results_df(vehicle_results: list):
+    import pandas as pd
 
     # At this point, we should be able to conver the results
     # lists into 2 dataframes
@@ -166,7 +192,18 @@ def nested_feature_geom_rollup(df):
     return df.groupby('vehicle_id').apply(create_geometies)
 
 
-def generate_sorted_feature_collections(vehicle_results: pd.DataFrame):
+def simplify_feature_geometries(features, tolerance=None):
+    from . import simplify
+
+    # Simplify every trace in one batch rather than one at a time
+    lines = [feat['geometry']['coordinates'] for feat in features]
+    for feat, line in zip(features, simplify.simplify_lines(lines, tolerance)):
+        feat['geometry']['coordinates'] = line
+
+
+def generate_sorted_feature_collections(vehicle_results: 'pd.DataFrame', tolerance=None):
+    import pandas as pd
+
     vr_sorted = vehicle_results.sort_values(by='timestamp')
     nested_features = vr_sorted.groupby(pd.Grouper(freq='10Min', key='timestamp')).apply(nested_feature_geom_rollup)
 
@@ -201,15 +238,28 @@ def generate_sorted_feature_collections(vehicle_results: pd.DataFrame):
     super_fc_list = []
     for secs in as_str:
         super_fc_list.append(super_fc[secs])
+
+    # Stopped and slow buses leave long runs of near identical points
+    simplify_feature_geometries([f for fc in super_fc_list for f in fc['features']], tolerance)
         
     return super_fc_list
 
 
-# Execution
-list_of_jsons = get_all_possible_jsons(day_dir)
-vehicle_results = generate_vehicle_results_df(list_of_jsons)
-sorted_fcs = generate_sorted_feature_collections(vehicle_results)
+def write_daily_json(vehicle_results, output=DEFAULT_OUTPUT, tolerance=None):
+    sorted_fcs = generate_sorted_feature_collections(vehicle_results, tolerance)
 
-import json
-with open('daily.json', 'w') as outfile:
-    json.dump(sorted_fcs, outfile)
+    with open(output, 'w') as outfile:
+        json.dump(sorted_fcs, outfile)
+
+
+def compile_daily(day_dir=DEFAULT_DAY_DIR, output=DEFAULT_OUTPUT, tolerance=None):
+    list_of_jsons = get_all_possible_jsons(day_dir)
+    vehicle_results = generate_vehicle_results_df(list_of_jsons)
+    write_daily_json(vehicle_results, output, tolerance)
+
+
+def compile_records_file(records_path, output=DEFAULT_OUTPUT, tolerance=None):
+    # Same as compile_daily, but from records appended one
+    # snapshot at a time as they were scraped
+    vehicle_results = build_vehicle_results_df(load_records_file(records_path))
+    write_daily_json(vehicle_results, output, tolerance)
@@ -1,26 +1,16 @@
 import colorsys
 import datetime
 import json
-import math
 import os
 import random
 import shutil
-import sys
-import time
-
-import dotenv
-import geopandas as gpd
-import numpy as np
-import pandas as pd
-from shapely.geometry import LineString, Point
 import subprocess
-import tweepy
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import time
 
 SECONDS_RESOLUTION = 10
+RAW_DIR = 'busdata_raw'
+OUTPUT_DIR = 'gif'
+GIF_LOC = 'gif/animate.gif'
 
 
 def get_env_var(env_var):
@@ -28,11 +18,18 @@ def get_env_var(env_var):
         raise KeyError('No tokens set under {} in .env file'.format(env_var))
     return str(os.environ[env_var])
 
-dotenv.load()  # Make sure we load in the .env file
-CONSUMER_KEY = get_env_var('CONSUMER_KEY')
-CONSUMER_SECRET = get_env_var('CONSUMER_SECRET')
-ACCESS_KEY = get_env_var('ACCESS_KEY')
-ACCESS_SECRET = get_env_var('ACCESS_SECRET')
+
+def get_twitter_credentials():
+    # Only read once we are actually about to tweet, so
+    # that the analysis functions can be used without them
+    import dotenv
+    dotenv.load()  # Make sure we load in the .env file
+    return {
+        'consumer_key': get_env_var('CONSUMER_KEY'),
+        'consumer_secret': get_env_var('CONSUMER_SECRET'),
+        'access_key': get_env_var('ACCESS_KEY'),
+        'access_secret': get_env_var('ACCESS_SECRET'),
+    }
 
 
 def parse_filename_as_datetime(filename):
@@ -158,6 +155,8 @@ def compile_trace_packages(keep_target_files):
 
 
 def generate_trace_dfs_reference(keep_target_files):
+    import pandas as pd
+
     # First, process in all the relevant
     # trace package filepaths
     compiled_traces = compile_trace_packages(keep_target_files)
@@ -193,68 +192,50 @@ def generate_trace_dfs_reference(keep_target_files):
     return compiled_traces_dfs
 
 
-def interpolate_intermediaries(total_segment, time_frame=SECONDS_RESOLUTION):
-    res = []
-    for fr, to in zip(total_segment[:-1], total_segment[1:]):
-        delta = to['timestamp'] - fr['timestamp']
-        break_count = math.ceil(delta/float(time_frame))
-        break_val = round(float(delta)/break_count, 3)
-
-        line = LineString([fr['position'], to['position']])
-        s = 0.000000001
-        n = break_count + 1
-        pts = [line.interpolate((i/n), normalized=True) for i in range(1, n)]
-
-        # Iterates through and breaks each segment into components that are
-        for i in range(len(pts)):
-            res.append({
-                'position': [pts[i].x, pts[i].y],
-                'timestamp': fr['timestamp'] + (break_val * i),
-            })
-    return res
-
-
-def calc_time_delta(df):
-    sorted_df = df.sort_values('timestamp')
-    deduped = sorted_df.drop_duplicates(subset=['timestamp'])
-    deduped = deduped.reset_index()
-    
-    res = []
-    for i, row in deduped.iterrows():
-        res.append({
-            'position': [row.lon, row.lat],
-            'timestamp': row.timestamp,
-        })
-    if len(res) > 3:
-        interpolated = interpolate_intermediaries(res)
-        return interpolated
-    else:
-        return None
-
-
-def clean_and_group_route_traces(compiled_traces_dfs):
-    # Initialize processed compiled dict
-    processed_traces = {}
-    for key in compiled_traces_dfs.keys():
-        # First pull out each route as a DataFrame
-        df = compiled_traces_dfs[key]
-        try:
-            # Then try and perform the chained group operations
-            parsed = df.groupby('veh_id').apply(lambda x: x.groupby('trip_id').apply(calc_time_delta))
-            parsed = parsed[~parsed.isnull()]
-            
-            # Let's just drop marginally relevant routes
-            # and not plot them here
-            if len(parsed) > 0:
-                processed_traces[key] = parsed
-        
-        # Some traces have no valid data for the timeframe
-        # although they emitted a location or two; in such situations
-        # just warn the user
-        except Exception as e:
-            print('Skipping {} because {}'.format(key, e))
-    
-    return processed_traces
+def clean_and_group_route_traces(compiled_traces_dfs, tolerance=None):
+    import numpy as np
+    import pandas as pd
+    from . import segment, simplify
+
+    # No route had any fixes in the timeframe
+    if not len(compiled_traces_dfs):
+        return {
+            'route': np.array([], dtype=object),
+            'vehicle_id': np.array([], dtype=object),
+            'trip_id': np.array([], dtype=object),
+            'offsets': np.zeros(1, dtype=np.int64),
+            'lon': np.zeros(0),
+            'lat': np.zeros(0),
+            'timestamp': np.zeros(0),
+        }
+
+    # Put every route's observations in one frame so that they
+    # can be sorted and split into trips in a single pass
+    all_traces = pd.concat([
+        df.assign(route=key) for key, df in compiled_traces_dfs.items()])
+    trajectories, skipped = segment.segment_trajectories(all_traces)
+
+    # Some trips have no valid data for the timeframe although
+    # they emitted a location or two; in such situations
+    # just warn the user
+    for skip in skipped:
+        print('Skipping route {} vehicle {} trip {} because {}'.format(
+            skip['route'], skip['vehicle_id'], skip['trip_id'], skip['reason']))
+
+    # Only the fixes needed to place each bus at any moment are kept;
+    # the plot interpolates between them frame by frame
+    coords = np.column_stack([trajectories['lon'], trajectories['lat']])
+    coords, offsets, keep = simplify.simplify_batch(
+        coords, trajectories['offsets'], tolerance,
+        timestamps=trajectories['timestamp'])
+
+    trajectories.update({
+        'offsets': offsets,
+        'lon': coords[:, 0],
+        'lat': coords[:, 1],
+        'timestamp': trajectories['timestamp'][keep],
+    })
+    return trajectories
 
 
 def make_rand_col():
@@ -263,9 +244,9 @@ def make_rand_col():
     return '#%02x%02x%02x' % (r,g,b)
 
 
-def generate_color_lookup(processed_traces):
+def generate_color_lookup(route_keys):
     color_lookup = {}
-    for key in processed_traces.keys():
+    for key in route_keys:
         color_lookup[key] = make_rand_col()
     return color_lookup
 
@@ -289,7 +270,15 @@ def get_plot_timeframe(compiled):
 
 
 def plot_grouped_route_trace_results(start, end, grouped):
-    color_lookup = generate_color_lookup(grouped)
+    import geopandas as gpd
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from shapely.geometry import Point
+    from . import segment
+
+    routes = grouped['route']
+    color_lookup = generate_color_lookup(set(routes))
     print('Start of analysis period: {}\nEnd of analysis period: {}'.format(start, end))
     print('Estimated coverage time: {}'.format(round((end - start)/60, 2)))
 
@@ -297,18 +286,13 @@ def plot_grouped_route_trace_results(start, end, grouped):
     count = 0
     while curr_thresh <= end:
         curr_thresh = start + (count * SECONDS_RESOLUTION)
+        # Each bus that has set out, at its position as of this frame
         to_plot = []
-        for key in grouped.keys():
-            parsed = grouped[key]
-            for p in parsed:
-                if not isinstance(p, list):
-                    continue
-                filtered_p = list(filter(lambda x: x['timestamp'] <= curr_thresh, p))
-                if len(filtered_p) > 0:
-                    most_recent = max(filtered_p, key=lambda x: x['timestamp'])
-                    to_plot.append({
-                        'p': Point(most_recent['position']),
-                        'color': color_lookup[key]})
+        indices, lons, lats = segment.positions_at(grouped, curr_thresh)
+        for i, lon, lat in zip(indices, lons, lats):
+            to_plot.append({
+                'p': Point(lon, lat),
+                'color': color_lookup[routes[i]]})
 
         # TODO: Clarify plotting structure
         # A vat of gobbledegook to poof out a matplotlib chart with little
@@ -338,71 +322,90 @@ def plot_grouped_route_trace_results(start, end, grouped):
         count += 1
 
 
-def tweet(gif_loc):
-    auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
-    auth.set_access_token(ACCESS_KEY, ACCESS_SECRET)
+def tweet(gif_loc, credentials=None, day=None):
+    import tweepy
+
+    # Name the day the animation covers, which is not the day it is sent
+    status = 'Today\'s peak hour of AC Transit bus traffic'
+    if day is not None:
+        date = datetime.datetime.strptime(day, '%Y%m%d')
+        status = 'Peak hour of AC Transit bus traffic on {} {}, {}'.format(
+            date.strftime('%B'), date.day, date.year)
+
+    if credentials is None:
+        credentials = get_twitter_credentials()
+
+    auth = tweepy.OAuthHandler(credentials['consumer_key'], credentials['consumer_secret'])
+    auth.set_access_token(credentials['access_key'], credentials['access_secret'])
     api = tweepy.API(auth)
-    api.update_with_media(gif_loc, status='Today\'s peak hour of AC Transit bus traffic')
-
-
-# Run when this script is invoked
-if __name__ == '__main__':
-    while True:
-        # Make sure that busdata_raw exists
-        dest_dir = 'busdata_raw'
-        if not os.path.exists(dest_dir):
-            os.makedirs(dest_dir)
-
-        tod = None
-        # We can pass a system argument to manually set the day to eval
-        if len(sys.argv) > 1:
-            tod = sys.argv[1]
-        else:
-            yesterday = datetime.date.today() - datetime.timedelta(1)
-            tod = yesterday.isoformat().replace('-', '')
-
-        # First pull down the previous day's images
-        formatted_command = 'gsutil cp gs://ac-transit/traces/{}/* {}/'.format(tod, dest_dir)
-        ret = os.system(formatted_command)
-        if ret != 0 :
+    api.update_with_media(gif_loc, status=status)
+
+
+def get_yesterday():
+    yesterday = datetime.date.today() - datetime.timedelta(1)
+    return yesterday.isoformat().replace('-', '')
+
+
+def render(tod=None, tolerance=None, raw_dir=None):
+    from . import scrape_loader
+
+    # Default to evaluating the previous day
+    if tod is None:
+        tod = get_yesterday()
+
+    # Pull the day's traces down into a directory of its own, unless
+    # the caller already has them; only one day is ever looked at
+    owns_raw_dir = raw_dir is None
+    if owns_raw_dir:
+        raw_dir = os.path.join(RAW_DIR, tod)
+        if not scrape_loader.download_day(tod, raw_dir):
             print('The gustil command to pull down a day\'s worth of traces failed.')
 
-        # Make sure that output_dir exists, so resulting files can be saved to
-        # this director adn clear out previous outputs
-        output_dir = 'gif'
-        if os.path.exists(output_dir):
-            shutil.rmtree(output_dir)
-        os.makedirs(output_dir)
+    # Make sure that output_dir exists, so resulting files can be saved to
+    # this director adn clear out previous outputs
+    output_dir = OUTPUT_DIR
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
 
-        target_filepaths = get_busiest_hour_filepaths('busdata_raw/')
+    try:
+        target_filepaths = get_busiest_hour_filepaths(raw_dir)
         compiled = generate_trace_dfs_reference(target_filepaths)
         start, end = get_plot_timeframe(compiled)
-        grouped = clean_and_group_route_traces(compiled)
+        grouped = clean_and_group_route_traces(compiled, tolerance)
         plot_grouped_route_trace_results(start, end, grouped)
+    finally:
+        if owns_raw_dir:
+            shutil.rmtree(raw_dir, ignore_errors=True)
+
+    try:
+        command = 'convert -limit memory 100MB -delay 10 -loop 0 gif/*.png -colors 64 -ordered-dither o8x8,8,8,4 +map -layers optimize gif/animate.gif'
+        process = subprocess.Popen(['/bin/bash', '-c', command])
+        process.wait()
+        ret = os.system(command)
+    except Exception as e:
+        print('The convert imagemagick command to compile into gif failed: {}'.format(e))
 
-        try:
-            command = 'convert -limit memory 100MB -delay 10 -loop 0 gif/*.png -colors 64 -ordered-dither o8x8,8,8,4 +map -layers optimize gif/animate.gif'
-            process = subprocess.Popen(['/bin/bash', '-c', command])
-            process.wait()
-            ret = os.system(command)
-        except Exception as e:
-            print('The convert imagemagick command to compile into gif failed: {}'.format(e))
-
-        try:
-            command = 'gifsicle -O1 gif/animate.gif -o gif/animate.gif'
-            process = subprocess.Popen(['/bin/bash', '-c', command])
-            process.wait()
-            ret = os.system(command)
-        except Exception as e:
-            print('The gifsicle optimization step failed: {}'.format(e))
-
-        # Now actually run the commands altogether
-        curr_day = time.strftime('%Y%m%d')
-        bash_cmd = 'sudo gsutil cp gif/animate.gif gs://ac-transit/daily_animated/{}.gif'.format(curr_day)
-        process = subprocess.Popen(['/bin/bash', '-c', bash_cmd])
+    try:
+        command = 'gifsicle -O1 gif/animate.gif -o gif/animate.gif'
+        process = subprocess.Popen(['/bin/bash', '-c', command])
         process.wait()
+        ret = os.system(command)
+    except Exception as e:
+        print('The gifsicle optimization step failed: {}'.format(e))
+
+    return GIF_LOC
+
+
+def publish(gif_loc=GIF_LOC, day=None):
+    # Credentials are checked before anything leaves the machine
+    credentials = get_twitter_credentials()
 
-        tweet('gif/animate.gif')
+    # Store the gif under the day it shows, falling back to
+    # today's date when that is not known
+    name = day if day is not None else time.strftime('%Y%m%d')
+    bash_cmd = 'sudo gsutil cp {} gs://ac-transit/daily_animated/{}.gif'.format(gif_loc, name)
+    process = subprocess.Popen(['/bin/bash', '-c', bash_cmd])
+    process.wait()
 
-        # Sleep until tomorrow
-        time.sleep(86400)
\ No newline at end of file
+    tweet(gif_loc, credentials, day)
@@ -0,0 +1,241 @@
+import os
+import queue
+import shutil
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import act_scraper
+from . import daily_compiler
+from . import gif_generator
+from . import scrape_loader
+
+SCRAPE_INTERVAL = 30
+UPLOAD_WORKERS = 4
+QUEUE_SIZE = 100
+
+# Messages passed between the stages; a snapshot is written
+# to disk, a day is closed once snapshots roll over into the
+# next one, and STOP is forwarded down the line on shutdown
+SNAPSHOT = 'snapshot'
+DAY_CLOSED = 'day_closed'
+STOP = None
+
+
+def _current_day():
+    return time.strftime('%Y%m%d')
+
+
+def _scrape_stage(outbox, stop, tokens, interval, seeded, last_day=None):
+    # A day is over once a snapshot lands in the next day's directory,
+    # but it is only announced once every leftover snapshot has been
+    # queued, so none of them can arrive after their day has closed
+    closed_days = []
+    while not stop.is_set():
+        try:
+            fpath = act_scraper.scrape_once(tokens)
+        except Exception as e:
+            print('Scrape failed: {}'.format(e))
+            fpath = None
+
+        # Blocks when downstream stages fall behind
+        if fpath is not None:
+            day = act_scraper.get_snapshot_day(fpath)
+            if last_day is not None and day != last_day:
+                closed_days.append(last_day)
+            last_day = day
+            outbox.put((SNAPSHOT, fpath, day))
+
+        if seeded.is_set():
+            for day in closed_days:
+                outbox.put((DAY_CLOSED, day))
+            closed_days = []
+
+        stop.wait(interval)
+
+
+def _record_stage(inbox, outbox):
+    # Each snapshot is parsed into its day's records file before it
+    # is handed on to be uploaded, which deletes it
+    while True:
+        item = inbox.get()
+        if item is STOP:
+            break
+
+        if item[0] == SNAPSHOT:
+            _, fpath, day = item
+            try:
+                scrape_loader.record_snapshot(fpath, day)
+            except Exception as e:
+                print('Recording {} failed: {}'.format(fpath, e))
+
+        outbox.put(item)
+
+    outbox.put(STOP)
+
+
+def _upload_snapshot(fpath, day):
+    try:
+        if scrape_loader.upload_file(fpath, day):
+            # Retried leftovers of an already finished day
+            scrape_loader.remove_local_day(day)
+    except Exception as e:
+        print('Uploading {} failed: {}'.format(fpath, e))
+
+
+def _upload_stage(inbox, outbox, workers):
+    slots = threading.BoundedSemaphore(workers)
+    pending = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            item = inbox.get()
+            if item is STOP:
+                break
+
+            if item[0] == SNAPSHOT:
+                _, fpath, day = item
+                # Hold off reading more work while every worker is busy
+                slots.acquire()
+                future = pool.submit(_upload_snapshot, fpath, day)
+                future.add_done_callback(lambda _: slots.release())
+                pending = [f for f in pending if not f.done()]
+                pending.append(future)
+            elif item[0] == DAY_CLOSED:
+                # Rendering pulls the day back down from storage, so
+                # everything from that day has to be up there first
+                wait(pending)
+                pending = []
+                outbox.put(item)
+
+    outbox.put(STOP)
+
+
+def _finalize_day(day, output, tolerance):
+    # The day's records were appended as each snapshot was written, and
+    # live on disk, so a restart partway through the day loses nothing
+    records_path = scrape_loader.get_records_path(day)
+    day_dir = os.path.join(gif_generator.RAW_DIR, day)
+    downloaded = False
+    try:
+        try:
+            if os.path.exists(records_path):
+                daily_compiler.compile_records_file(records_path, output, tolerance)
+            else:
+                # Without records, fall back to what is in storage
+                downloaded = scrape_loader.download_day(day, day_dir)
+                if not downloaded:
+                    print('Not compiling {}; it will be retried on the next start'.format(day))
+                    return
+                daily_compiler.compile_daily(day_dir + '/', output, tolerance)
+            print('Compiled {} to {}'.format(day, output))
+        except Exception as e:
+            print('Compiling {} failed: {}'.format(day, e))
+            return
+
+        # Rendering needs the raw snapshots, which are only in storage now
+        if not downloaded and not scrape_loader.download_day(day, day_dir):
+            print('Not rendering {}; it will be retried on the next start'.format(day))
+            return
+
+        try:
+            gif_loc = gif_generator.render(day, tolerance, raw_dir=day_dir)
+            gif_generator.publish(gif_loc, day)
+        except Exception as e:
+            print('Rendering {} failed: {}'.format(day, e))
+    finally:
+        shutil.rmtree(day_dir, ignore_errors=True)
+
+    # The day is done; it is never finalized again, even if some of
+    # its snapshots still have to be uploaded on a later start
+    scrape_loader.mark_day_done(day)
+    scrape_loader.remove_local_day(day)
+
+
+def _finalize_stage(inbox, output, tolerance):
+    # A single worker, since renders share the gif/ output directory
+    while True:
+        item = inbox.get()
+        if item is STOP:
+            break
+
+        _finalize_day(item[1], output, tolerance)
+
+
+def _get_open_day(backlog):
+    # The day a previous run was still scraping into, if it is today
+    today = _current_day()
+    open_days = [day for day, _ in backlog if day >= today]
+    return open_days[-1] if len(open_days) else None
+
+
+def _list_backlog():
+    # Taken before scraping starts, so that new snapshots (which go
+    # straight into the pipeline) are never queued a second time
+    return [(day, scrape_loader.list_local_snapshots_for_day(day))
+            for day in scrape_loader.list_local_days()]
+
+
+def _seed_backlog(outbox, backlog, stop, seeded):
+    # Pick up whatever a previous run left behind. Any directory from
+    # before today that is not marked done still needs closing
+    today = _current_day()
+    try:
+        for day, snapshots in backlog:
+            for fpath, _ in snapshots:
+                if stop.is_set():
+                    # Whatever is left is picked up on the next start
+                    return
+                outbox.put((SNAPSHOT, fpath, day))
+
+            if scrape_loader.is_day_done(day):
+                scrape_loader.remove_local_day(day)
+            elif day < today:
+                outbox.put((DAY_CLOSED, day))
+    finally:
+        seeded.set()
+
+
+def run(interval=SCRAPE_INTERVAL, upload_workers=UPLOAD_WORKERS,
+        queue_size=QUEUE_SIZE, output=daily_compiler.DEFAULT_OUTPUT, tolerance=None):
+    tokens = act_scraper.get_tokens()
+    print('Using {} tokens'.format(len(tokens)))
+
+    to_record = queue.Queue(maxsize=queue_size)
+    to_upload = queue.Queue(maxsize=queue_size)
+    to_finalize = queue.Queue(maxsize=queue_size)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print('Received signal {}; draining pipeline'.format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    stages = [
+        threading.Thread(target=_record_stage, args=(to_record, to_upload)),
+        threading.Thread(target=_upload_stage, args=(to_upload, to_finalize, upload_workers)),
+        threading.Thread(target=_finalize_stage, args=(to_finalize, output, tolerance)),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # Leftovers are seeded alongside live scraping, so a large backlog
+    # from a long outage does not hold up new snapshots. The current
+    # day's directory is left in place on shutdown, so it goes through
+    # the same path if the next start is on a later day
+    backlog = _list_backlog()
+    seeded = threading.Event()
+    seeder = threading.Thread(target=_seed_backlog, args=(to_record, backlog, stop, seeded))
+    seeder.start()
+
+    # Scraping runs on the main thread so it is the one to see signals
+    _scrape_stage(to_record, stop, tokens, interval, seeded, _get_open_day(backlog))
+
+    # Only stop the line once the seeder can no longer add to it
+    seeder.join()
+    to_record.put(STOP)
+    for stage in stages:
+        stage.join()
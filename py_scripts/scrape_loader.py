@@ -1,6 +1,10 @@
 import os
+import shutil
 import subprocess
-import time
+
+MAIN_DIR = 'busdata'
+DONE_MARKER = '.done'
+RECORDS_FILE = 'records.jsonl'
 
 
 def _format_gcloud_bash(filepath, day_dir):
@@ -9,44 +13,96 @@ def _format_gcloud_bash(filepath, day_dir):
     return formatted
 
 
-def sync_storage_from_local():
-    # First, get all directories in busdata
-    main_dir = 'busdata'
-    all_day_directories = [g for g in os.walk(main_dir)][0][1]
+def list_local_days(main_dir=MAIN_DIR):
+    # Day directories stay around until their day has been finalized
+    # and every snapshot in them uploaded
+    if not os.path.exists(main_dir):
+        return []
+    return sorted([g for g in os.walk(main_dir)][0][1])
+
 
+def list_local_snapshots_for_day(day_dir, main_dir=MAIN_DIR):
+    full_day_dir_path = os.path.join(main_dir, day_dir)
+
+    to_upload = []
+    for filename in sorted(os.listdir(full_day_dir_path)):
+        if filename.endswith('.json'):
+            fpath = os.path.join(full_day_dir_path, filename)
+            to_upload.append((fpath, day_dir))
+    return to_upload
+
+
+def list_local_snapshots(main_dir=MAIN_DIR):
     # Craft a full list of paths to upload
     to_upload = []
-    for day_dir in all_day_directories:
-        full_day_dir_path = os.path.join(main_dir, day_dir)
+    for day_dir in list_local_days(main_dir):
+        to_upload.extend(list_local_snapshots_for_day(day_dir, main_dir))
+    return to_upload
+
+
+def upload_file(fpath, day_dir):
+    # Upload a single snapshot and only remove it once it
+    # is safely in storage
+    process = subprocess.Popen(['/bin/bash', '-c', _format_gcloud_bash(fpath, day_dir)])
+    if process.wait() != 0:
+        print('Upload of {} failed; leaving it in place'.format(fpath))
+        return False
 
-        for filename in os.listdir(full_day_dir_path):
-            if filename.endswith('.json'):
-                fpath = os.path.join(full_day_dir_path, filename)
-                to_upload.append((fpath, day_dir))
+    os.remove(fpath)
+    return True
 
-    upload_command = []
-    for fpath, day_dir in to_upload:
-        # First we want to upload the file
-        new_cmd = _format_gcloud_bash(fpath, day_dir)
-        upload_command.append(new_cmd)
 
-    # Now concat them all to a single command
-    single_bash = ' && '.join(upload_command)
+def download_day(day_dir, dest_dir):
+    # Pull a whole day's uploaded snapshots back down from storage
+    if not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
 
-    # Now actually run the commands altogether
-    process = subprocess.Popen(['/bin/bash', '-c', single_bash])
+    formatted_command = 'gsutil cp gs://ac-transit/traces/{}/* {}/'.format(day_dir, dest_dir)
+    process = subprocess.Popen(['/bin/bash', '-c', formatted_command])
+    if process.wait() != 0:
+        print('Download of {} traces failed'.format(day_dir))
+        return False
+    return True
 
-    # Block all further python ops until process completes
-    process.wait()
 
-    # Now we can remove those files that were uploaded
-    for fpath, _ in to_upload:
-        os.remove(fpath)
+def get_records_path(day_dir, main_dir=MAIN_DIR):
+    # The day's parsed records, kept alongside its snapshots
+    return os.path.join(main_dir, day_dir, RECORDS_FILE)
 
 
-# Start this python process
-while True:
-    sync_storage_from_local()
+def record_snapshot(fpath, day_dir, main_dir=MAIN_DIR):
+    # Must happen before the upload, which deletes the snapshot
+    from . import daily_compiler
+    daily_compiler.append_snapshot_records(fpath, get_records_path(day_dir, main_dir))
+
+
+def is_day_done(day_dir, main_dir=MAIN_DIR):
+    return os.path.exists(os.path.join(main_dir, day_dir, DONE_MARKER))
+
+
+def mark_day_done(day_dir, main_dir=MAIN_DIR):
+    # Recorded once a day has been compiled and published, so that
+    # it is never finalized a second time
+    with open(os.path.join(main_dir, day_dir, DONE_MARKER), 'w') as f:
+        f.write('')
+
+
+def remove_local_day(day_dir, main_dir=MAIN_DIR):
+    # Safe to call at any time; the directory only goes once its day
+    # is done and nothing is left in it waiting to be uploaded
+    full_day_dir_path = os.path.join(main_dir, day_dir)
+    if not is_day_done(day_dir, main_dir):
+        return
+    if len(list_local_snapshots_for_day(day_dir, main_dir)):
+        return
+    shutil.rmtree(full_day_dir_path)
+
+
+def sync_storage_from_local():
+    # Files that fail to upload are left in place for the next sync
+    for fpath, day_dir in list_local_snapshots():
+        record_snapshot(fpath, day_dir)
+        upload_file(fpath, day_dir)
 
-    # Run this every minute
-    time.sleep(60)
+    for day_dir in list_local_days():
+        remove_local_day(day_dir)
@@ -0,0 +1,147 @@
+import numpy as np
+
+# Trips with this many distinct fixes or fewer are not worth plotting
+MIN_FIXES = 4
+
+
+def _group_starts(*codes):
+    # True wherever a row begins a new group, given rows already sorted
+    starts = np.zeros(len(codes[0]), dtype=bool)
+    if len(starts):
+        starts[0] = True
+        for c in codes:
+            starts[1:] |= np.diff(c) != 0
+    return starts
+
+
+def _key_values(uniques):
+    # Missing keys factorize to -1, which then lands on the None on the end
+    return np.append(np.asarray(uniques, dtype=object), None)
+
+
+def segment_trajectories(df, route_col='route', vehicle_col='veh_id',
+                         trip_col='trip_id', min_fixes=MIN_FIXES):
+    """Split observations into one trajectory per (route, vehicle, trip).
+
+    All observations are sorted once by (route, vehicle, trip, timestamp)
+    and group boundaries are found from where those keys change. Repeated
+    timestamps within a trip are dropped, as are fixes without a usable
+    position. Returns ``(trajectories, skipped)``: ``trajectories`` is a
+    dict of flat ``lon``, ``lat`` and ``timestamp`` arrays, with trajectory
+    ``i`` at ``offsets[i]:offsets[i + 1]`` and its keys in ``route``,
+    ``vehicle_id`` and ``trip_id``; ``skipped`` lists the groups left out,
+    each as a dict of the same keys plus a ``reason``.
+    """
+    import pandas as pd
+
+    route_codes, route_vals = pd.factorize(df[route_col])
+    veh_codes, veh_vals = pd.factorize(df[vehicle_col])
+    trip_codes, trip_vals = pd.factorize(df[trip_col])
+    route_vals = _key_values(route_vals)
+    veh_vals = _key_values(veh_vals)
+    trip_vals = _key_values(trip_vals)
+    lon = df['lon'].values.astype(float)
+    lat = df['lat'].values.astype(float)
+    timestamp = df['timestamp'].values.astype(float)
+
+    # Fixes that cannot be placed or attributed to a trip are dropped
+    valid = np.isfinite(lon) & np.isfinite(lat) & np.isfinite(timestamp)
+    valid &= (route_codes >= 0) & (veh_codes >= 0) & (trip_codes >= 0)
+
+    # One sort for everything; lexsort orders by the last key first.
+    # Invalid fixes go to the end of their group, so that they are
+    # never the fix a valid one is compared against below
+    order = np.lexsort((timestamp, ~valid, trip_codes, veh_codes, route_codes))
+    route_codes = route_codes[order]
+    veh_codes = veh_codes[order]
+    trip_codes = trip_codes[order]
+    lon = lon[order]
+    lat = lat[order]
+    timestamp = timestamp[order]
+    valid = valid[order]
+
+    # Drop repeats of the previous fix's timestamp within the same group
+    starts = _group_starts(route_codes, veh_codes, trip_codes)
+    repeated = np.zeros(len(timestamp), dtype=bool)
+    repeated[1:] = ~starts[1:] & (np.diff(timestamp) == 0)
+    keep = valid & ~repeated
+
+    # Count what survives in every group, including groups with nothing left
+    group_ids = np.cumsum(starts) - 1
+    group_rows = np.flatnonzero(starts)
+    counts = np.bincount(group_ids[keep], minlength=len(group_rows))
+    invalid = np.bincount(group_ids[~valid], minlength=len(group_rows))
+
+    def group_keys(rows):
+        return (route_vals[route_codes[rows]],
+                veh_vals[veh_codes[rows]],
+                trip_vals[trip_codes[rows]])
+
+    skipped = []
+    too_short = counts < min_fixes
+    for g in np.flatnonzero(too_short):
+        route, vehicle_id, trip_id = [k[0] for k in group_keys(group_rows[[g]])]
+        reason = 'only {} distinct fixes'.format(counts[g])
+        if invalid[g]:
+            reason += ' ({} without a valid position or key)'.format(invalid[g])
+        skipped.append({
+            'route': route,
+            'vehicle_id': vehicle_id,
+            'trip_id': trip_id,
+            'reason': reason,
+        })
+
+    # Keep only the rows of groups long enough to use
+    keep &= ~too_short[group_ids]
+    used = ~too_short
+    offsets = np.concatenate([[0], np.cumsum(counts[used])])
+    routes, vehicle_ids, trip_ids = group_keys(group_rows[used])
+
+    trajectories = {
+        'route': np.asarray(routes),
+        'vehicle_id': np.asarray(vehicle_ids),
+        'trip_id': np.asarray(trip_ids),
+        'offsets': offsets,
+        'lon': lon[keep],
+        'lat': lat[keep],
+        'timestamp': timestamp[keep],
+    }
+    return trajectories, skipped
+
+
+def positions_at(trajectories, t):
+    """Where every trajectory is at time ``t``.
+
+    Positions are interpolated linearly between consecutive fixes, and held
+    at the last fix once a trajectory has ended. Returns ``(indices, lon,
+    lat)`` for the trajectories that have started by ``t``.
+    """
+    offsets = trajectories['offsets']
+    timestamp = trajectories['timestamp']
+    lon = trajectories['lon']
+    lat = trajectories['lat']
+
+    firsts = offsets[:-1]
+    lasts = offsets[1:] - 1
+    started = lasts >= firsts
+    started[started] = timestamp[firsts[started]] <= t
+    indices = np.flatnonzero(started)
+    if not len(indices):
+        return indices, np.zeros(0), np.zeros(0)
+
+    # Shift each trajectory's timestamps into its own band so a single
+    # search finds the last fix at or before t within every trajectory
+    t_min = timestamp.min()
+    span = timestamp.max() - t_min + 1
+    trip_ids = np.repeat(np.arange(len(firsts)), offsets[1:] - firsts)
+    banded = (timestamp - t_min) + trip_ids * span
+    query = (min(t, t_min + span - 1) - t_min) + indices * span
+    before = np.searchsorted(banded, query, side='right') - 1
+    after = np.minimum(before + 1, lasts[indices])
+
+    gap = timestamp[after] - timestamp[before]
+    safe_gap = np.where(gap > 0, gap, 1.0)
+    frac = np.clip(np.where(gap > 0, (t - timestamp[before]) / safe_gap, 0.0), 0.0, 1.0)
+    return (indices,
+            lon[before] + (lon[after] - lon[before]) * frac,
+            lat[before] + (lat[after] - lat[before]) * frac)
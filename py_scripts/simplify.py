@@ -0,0 +1,128 @@
+import numpy as np
+
+# In the same units as the coordinates (degrees); roughly 5m
+# at AC Transit's latitude, well under a pixel in the outputs
+DEFAULT_TOLERANCE = 0.00005
+
+
+def _segment_distances(points, starts, ends):
+    # Distance of each point from the segment between its anchors,
+    # clamped so that points past either end measure to that end
+    seg = ends - starts
+    seg_len_sq = (seg ** 2).sum(axis=1)
+    safe_len_sq = np.where(seg_len_sq > 0, seg_len_sq, 1.0)
+    t = ((points - starts) * seg).sum(axis=1) / safe_len_sq
+    t = np.clip(np.where(seg_len_sq > 0, t, 0.0), 0.0, 1.0)
+    nearest = starts + seg * t[:, None]
+    return np.sqrt(((points - nearest) ** 2).sum(axis=1))
+
+
+def _synchronized_distances(points, times, starts, ends, start_times, end_times):
+    # Distance of each point from where it would be at the same moment
+    # if the vehicle moved at a constant speed between the anchors
+    span = end_times - start_times
+    safe_span = np.where(span > 0, span, 1.0)
+    t = np.where(span > 0, (times - start_times) / safe_span, 0.0)
+    expected = starts + (ends - starts) * t[:, None]
+    return np.sqrt(((points - expected) ** 2).sum(axis=1))
+
+
+def simplify_mask(coords, offsets, tolerance=DEFAULT_TOLERANCE, timestamps=None):
+    """Douglas-Peucker over a batch of trajectories at once.
+
+    ``coords`` is an (n, 2) array holding every trajectory back to back,
+    with trajectory ``i`` at ``coords[offsets[i]:offsets[i + 1]]``. When
+    ``timestamps`` are given, the synchronized (time-aware) distance is
+    used instead, so kept points still describe where a vehicle was and
+    when. Returns a boolean mask of the points to keep; a tolerance of 0
+    keeps everything and None uses the default.
+    """
+    if tolerance is None:
+        tolerance = DEFAULT_TOLERANCE
+
+    coords = np.asarray(coords, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if timestamps is not None:
+        timestamps = np.asarray(timestamps, dtype=float)
+
+    keep = np.zeros(len(coords), dtype=bool)
+    if tolerance <= 0:
+        keep[:] = True
+        return keep
+
+    # Always keep both ends of every non-empty trajectory
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+    non_empty = ends >= starts
+    keep[starts[non_empty]] = True
+    keep[ends[non_empty]] = True
+
+    # Every trajectory is one open segment to begin with; each pass
+    # splits all of the open segments, across all trajectories, together
+    seg_starts = starts[non_empty]
+    seg_ends = ends[non_empty]
+    while True:
+        interior = seg_ends - seg_starts - 1
+        has_interior = interior > 0
+        seg_starts = seg_starts[has_interior]
+        seg_ends = seg_ends[has_interior]
+        interior = interior[has_interior]
+        if not len(seg_starts):
+            break
+
+        # Flatten the interior points of every segment into one array
+        seg_ids = np.repeat(np.arange(len(seg_starts)), interior)
+        first = np.cumsum(interior) - interior
+        idx = seg_starts[seg_ids] + 1 + (np.arange(len(seg_ids)) - first[seg_ids])
+
+        a = seg_starts[seg_ids]
+        b = seg_ends[seg_ids]
+        if timestamps is None:
+            dist = _segment_distances(coords[idx], coords[a], coords[b])
+        else:
+            dist = _synchronized_distances(
+                coords[idx], timestamps[idx], coords[a], coords[b],
+                timestamps[a], timestamps[b])
+
+        # Furthest point in each segment (first one wins a tie)
+        seg_max = np.maximum.reduceat(dist, first)
+        is_max = dist == seg_max[seg_ids]
+        candidates = np.flatnonzero(is_max)
+        _, first_hit = np.unique(seg_ids[candidates], return_index=True)
+        split_at = idx[candidates[first_hit]]
+
+        # Segments already within tolerance are done
+        split = seg_max > tolerance
+        split_at = split_at[split]
+        keep[split_at] = True
+
+        seg_starts = np.concatenate([seg_starts[split], split_at])
+        seg_ends = np.concatenate([split_at, seg_ends[split]])
+
+    return keep
+
+
+def simplify_batch(coords, offsets, tolerance=DEFAULT_TOLERANCE, timestamps=None):
+    """Simplify a batch of trajectories, returning (coords, offsets, mask).
+
+    The returned offsets index the simplified coordinates the same way
+    the input offsets index the originals; ``mask`` can be used to
+    carry along any other per-point columns.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    keep = simplify_mask(coords, offsets, tolerance, timestamps)
+    kept_before = np.concatenate([[0], np.cumsum(keep)])
+    return np.asarray(coords)[keep], kept_before[offsets], keep
+
+
+def simplify_lines(lines, tolerance=DEFAULT_TOLERANCE):
+    """Simplify a list of coordinate lists, as used in GeoJSON geometries."""
+    if not len(lines):
+        return []
+
+    lengths = np.array([len(line) for line in lines], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    coords = np.array([c for line in lines for c in line], dtype=float).reshape(-1, 2)
+
+    simplified, new_offsets, _ = simplify_batch(coords, offsets, tolerance)
+    return [simplified[s:e].tolist() for s, e in zip(new_offsets[:-1], new_offsets[1:])]
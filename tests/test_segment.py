@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+from py_scripts import segment
+
+KEYS = ['route', 'veh_id', 'trip_id']
+
+
+def _reference(df, min_fixes=segment.MIN_FIXES):
+    # The per-group pandas version the segmentation replaces
+    valid = (np.isfinite(df.lon) & np.isfinite(df.lat) & np.isfinite(df.timestamp)
+             & df[KEYS].notnull().all(axis=1))
+    deduped = (df[valid]
+               .sort_values(KEYS + ['timestamp'], kind='mergesort')
+               .drop_duplicates(subset=KEYS + ['timestamp']))
+    return {key: group[['lon', 'lat', 'timestamp']].values.astype(float)
+            for key, group in deduped.groupby(KEYS)
+            if len(group) >= min_fixes}
+
+
+def _as_dict(trajectories):
+    offsets = trajectories['offsets']
+    result = {}
+    for i, key in enumerate(zip(trajectories['route'], trajectories['vehicle_id'],
+                                trajectories['trip_id'])):
+        s, e = offsets[i], offsets[i + 1]
+        result[key] = np.column_stack([
+            trajectories['lon'][s:e], trajectories['lat'][s:e], trajectories['timestamp'][s:e]])
+    return result
+
+
+def _random_observations(seed=0):
+    rng = np.random.RandomState(seed)
+    rows = []
+    for route in ['18', '51', '72']:
+        for veh in ['a', 'b', 'c']:
+            for trip in ['t1', 't2']:
+                n = rng.randint(0, 12)
+                for ts in rng.randint(0, 20, size=n) * 30:
+                    rows.append({'route': route, 'veh_id': veh, 'trip_id': trip,
+                                 'lon': rng.normal(), 'lat': rng.normal(), 'timestamp': ts})
+    df = pd.DataFrame(rows)
+
+    # Sprinkle in fixes that cannot be placed
+    bad = rng.rand(len(df)) < 0.1
+    df.loc[bad, 'lat'] = np.nan
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_matches_pandas_groupby_reference():
+    for seed in range(5):
+        df = _random_observations(seed)
+        trajectories, skipped = segment.segment_trajectories(df)
+
+        result = _as_dict(trajectories)
+        expected = _reference(df)
+        assert sorted(result) == sorted(expected)
+        for key in expected:
+            assert np.array_equal(result[key], expected[key])
+
+        # Every other group is reported as skipped
+        groups = set(zip(df.route, df.veh_id, df.trip_id))
+        skipped_keys = {(s['route'], s['vehicle_id'], s['trip_id']) for s in skipped}
+        assert skipped_keys == groups - set(expected)
+
+
+def _fixes(trip, timestamps, lat=0.0):
+    return [{'route': '18', 'veh_id': 'v', 'trip_id': trip,
+             'lon': float(ts), 'lat': lat, 'timestamp': ts} for ts in timestamps]
+
+
+def test_valid_fix_is_not_a_repeat_of_an_invalid_one():
+    rows = _fixes('t', [5], lat=np.nan) + _fixes('t', [5, 10, 20, 30])
+    trajectories, skipped = segment.segment_trajectories(pd.DataFrame(rows))
+
+    assert skipped == []
+    assert trajectories['timestamp'].tolist() == [5, 10, 20, 30]
+
+
+def test_short_and_invalid_trips_are_skipped_with_reasons():
+    rows = (_fixes('single', [0])
+            + _fixes('invalid', [0, 10, 20, 30], lat=np.nan)
+            + _fixes('repeats', [0, 0, 10, 10, 20])
+            + _fixes('ok', [0, 10, 20, 30]))
+    rows.append(dict(_fixes('ok', [40])[0], trip_id=None))
+    trajectories, skipped = segment.segment_trajectories(pd.DataFrame(rows))
+
+    assert trajectories['trip_id'].tolist() == ['ok']
+    reasons = {s['trip_id']: s['reason'] for s in skipped}
+    assert reasons == {
+        'single': 'only 1 distinct fixes',
+        'invalid': 'only 0 distinct fixes (4 without a valid position or key)',
+        'repeats': 'only 3 distinct fixes',
+        None: 'only 0 distinct fixes (1 without a valid position or key)',
+    }
+
+
+def test_no_observations():
+    df = pd.DataFrame(columns=KEYS + ['lon', 'lat', 'timestamp'])
+    trajectories, skipped = segment.segment_trajectories(df)
+
+    assert trajectories['offsets'].tolist() == [0]
+    assert len(trajectories['lon']) == 0
+    assert skipped == []
+
+
+def _trajectories(trips):
+    lengths = [len(t) for t in trips]
+    points = np.array([p for t in trips for p in t], dtype=float).reshape(-1, 3)
+    return {
+        'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        'timestamp': points[:, 0],
+        'lon': points[:, 1],
+        'lat': points[:, 2],
+    }
+
+
+def test_positions_at_matches_per_trip_interpolation():
+    rng = np.random.RandomState(3)
+    trips = []
+    for n in [1, 2, 5, 30, 1, 12]:
+        start = rng.randint(0, 500)
+        times = start + np.cumsum(rng.randint(1, 60, size=n))
+        trips.append([(t, rng.normal(), rng.normal()) for t in times])
+    trajectories = _trajectories(trips)
+
+    for t in [-10, 0, 37.5, 250, 501, 900, 5000]:
+        indices, lon, lat = segment.positions_at(trajectories, t)
+
+        expected = [(i, np.interp(t, [p[0] for p in trip], [p[1] for p in trip]),
+                     np.interp(t, [p[0] for p in trip], [p[2] for p in trip]))
+                    for i, trip in enumerate(trips) if trip[0][0] <= t]
+        assert indices.tolist() == [e[0] for e in expected]
+        assert np.allclose(lon, [e[1] for e in expected])
+        assert np.allclose(lat, [e[2] for e in expected])
+
+
+def test_positions_at_with_no_trajectories():
+    trajectories = _trajectories([])
+    indices, lon, lat = segment.positions_at(trajectories, 100)
+    assert len(indices) == len(lon) == len(lat) == 0
@@ -0,0 +1,104 @@
+import numpy as np
+
+from py_scripts import simplify
+
+
+def _distance(p, a, b, t=None, ta=None, tb=None):
+    # Point-to-segment, or synchronized when times are given
+    if t is not None:
+        frac = (t - ta) / (tb - ta) if tb > ta else 0.0
+        return np.hypot(*(p - (a + (b - a) * frac)))
+    seg = b - a
+    seg_len_sq = seg @ seg
+    frac = 0.0 if seg_len_sq == 0 else np.clip((p - a) @ seg / seg_len_sq, 0.0, 1.0)
+    return np.hypot(*(p - (a + seg * frac)))
+
+
+def _reference_keep(points, tolerance, times=None):
+    # Plain recursive Douglas-Peucker over a single trajectory
+    keep = np.zeros(len(points), dtype=bool)
+    if not len(points):
+        return keep
+    keep[0] = keep[-1] = True
+
+    def recurse(s, e):
+        if e - s < 2:
+            return
+        dists = [_distance(points[i], points[s], points[e],
+                           *((times[i], times[s], times[e]) if times is not None else ()))
+                 for i in range(s + 1, e)]
+        best = int(np.argmax(dists))
+        if dists[best] > tolerance:
+            keep[s + 1 + best] = True
+            recurse(s, s + 1 + best)
+            recurse(s + 1 + best, e)
+
+    recurse(0, len(points) - 1)
+    return keep
+
+
+def _random_batch(lengths, seed=0):
+    rng = np.random.RandomState(seed)
+    lines = [np.cumsum(rng.normal(size=(n, 2)), axis=0) * 0.001 for n in lengths]
+    times = [np.cumsum(rng.randint(1, 60, size=n)).astype(float) for n in lengths]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    coords = np.concatenate([l.reshape(-1, 2) for l in lines])
+    return lines, times, coords, np.concatenate(times), offsets
+
+
+def test_matches_recursive_douglas_peucker():
+    # Empty, single point and two point trips sit among longer ones
+    lengths = [0, 1, 2, 3, 50, 0, 200, 7]
+    lines, _, coords, _, offsets = _random_batch(lengths)
+
+    keep = simplify.simplify_mask(coords, offsets, 0.001)
+
+    expected = np.concatenate([_reference_keep(l, 0.001) for l in lines])
+    assert keep.tolist() == expected.tolist()
+
+
+def test_time_aware_matches_recursive_reference():
+    lengths = [0, 1, 4, 30, 120]
+    lines, times, coords, timestamps, offsets = _random_batch(lengths, seed=1)
+
+    keep = simplify.simplify_mask(coords, offsets, 0.001, timestamps=timestamps)
+
+    expected = np.concatenate([_reference_keep(l, 0.001, t) for l, t in zip(lines, times)])
+    assert keep.tolist() == expected.tolist()
+
+
+def test_stopped_vehicle_is_kept_in_time():
+    # A bus that sits still and then moves keeps the moment it set off
+    coords = np.array([[0, 0], [0, 0], [0, 0], [0, 0], [1, 0]], dtype=float)
+    times = np.array([0, 10, 20, 30, 40], dtype=float)
+
+    spatial = simplify.simplify_mask(coords, [0, 5], 0.01)
+    timed = simplify.simplify_mask(coords, [0, 5], 0.01, timestamps=times)
+
+    assert spatial.tolist() == [True, False, False, False, True]
+    assert timed.tolist() == [True, False, False, True, True]
+
+
+def test_zero_tolerance_keeps_everything():
+    _, _, coords, _, offsets = _random_batch([0, 1, 5, 20])
+    assert simplify.simplify_mask(coords, offsets, 0).all()
+
+
+def test_batch_offsets_index_simplified_coords():
+    lengths = [0, 1, 2, 40, 0, 60]
+    lines, _, coords, _, offsets = _random_batch(lengths, seed=2)
+
+    simplified, new_offsets, keep = simplify.simplify_batch(coords, offsets, 0.001)
+
+    assert len(new_offsets) == len(offsets)
+    assert len(simplified) == keep.sum()
+    for line, s, e in zip(lines, new_offsets[:-1], new_offsets[1:]):
+        expected = line.reshape(-1, 2)[_reference_keep(line, 0.001)]
+        assert np.array_equal(simplified[s:e], expected)
+
+
+def test_simplify_lines():
+    lines = [[[0, 0], [1, 0.00001], [2, 0], [3, 5]], [], [[4, 4]]]
+    assert simplify.simplify_lines(lines, 0.001) == [
+        [[0.0, 0.0], [2.0, 0.0], [3.0, 5.0]], [], [[4.0, 4.0]]]
+    assert simplify.simplify_lines([], 0.001) == []